@@ -1,17 +1,40 @@
+from __future__ import annotations
+
 import logging
 import sys
-from argparse import ArgumentParser
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
 
 from .exceptions import VersionIncrError
-from .files import VersionFile
-from .git import Git
-from .utils import parse_bool
+
+if TYPE_CHECKING:
+    from argparse import ArgumentParser, Namespace
 
 __all__ = ['VersionIncrError', 'main']
 log = logging.getLogger(__name__)
 
 
-def _main():
+# Argument values to use when no arguments (other than --debug / -d) were provided
+_DEFAULTS = {
+    'file': None,
+    'encoding': 'utf-8',
+    'suffix': False,
+    'no_add': False,
+    'update_amended': False,
+    'ignore_staged': False,
+    'ignore_cache_age': False,
+    'no_pipe_bypass': False,
+    'dry_run': None,
+}
+
+
+@lru_cache(1)
+def _get_parser() -> ArgumentParser:
+    from argparse import ArgumentParser
+
+    from .utils import parse_bool
+
     # fmt: off
     parser = ArgumentParser(description='Python project version incrementer (to be run as a pre-commit hook)')
     parser.add_argument('--file', '-f', metavar='PATH', help='The file that contains the version to be incremented')
@@ -28,27 +51,46 @@ def _main():
     out_group.add_argument('--no_pipe_bypass', '-B', action='store_true', help="Do not bypass pre-commit's stdout pipe when printing the updated version number")
     out_group.add_argument('--debug', '-d', action='store_true', help='Show debug logging')
     parser.add_argument('--dry_run', '-D', type=parse_bool, help='Show the actions that would be taken without modifying any files')
-    args = parser.parse_args()
     # fmt: on
+    return parser
+
+
+def _parse_args(argv: list[str] | None = None) -> Namespace | SimpleNamespace:
+    if argv is None:
+        argv = sys.argv[1:]
+    if all(arg in ('-d', '--debug') for arg in argv):  # The common case when running as a hook - skip argparse
+        return SimpleNamespace(**_DEFAULTS, debug=bool(argv))
+    return _get_parser().parse_args(argv)
+
+
+def _main():
+    args = _parse_args()
+    # These are imported after parsing arguments so that `--help` and argument errors do not need to load them
+    from .files import VersionFile
+    from .git import Git
+
     if args.debug:
         logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(name)s %(lineno)d %(message)s')
     else:
         logging.basicConfig(level=logging.INFO, format='%(message)s')
 
+    file = VersionFile.find(args.file, args.encoding, args.dry_run)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f'Found {file=}')
+
+    Git.prefetch(file.posix_path)
     if args.dry_run is None and not Git.get_current_commit_command():
         log.debug('Running outside of a git commit - setting --dry_run=true')
-        args.dry_run = True
-
-    file = VersionFile.find(args.file, args.encoding, args.dry_run)
-    log.debug(f'Found {file=}')
+        file.dry_run = True
 
     if file.should_update(args.ignore_staged, args.update_amended, args.ignore_cache_age):
-        file.update_version(args.no_pipe_bypass, args.suffix)
-        if args.no_add:
-            log.debug(f'Skipping `git add {file.path.as_posix()}`')
+        if not file.update_version(args.no_pipe_bypass, args.suffix):
+            log.debug(f'The version file was not modified - skipping `git add {file.posix_path}`')
+        elif args.no_add:
+            log.debug(f'Skipping `git add {file.posix_path}`')
         else:
             log.debug('Adding updated version file to the commit...')
-            Git.add(file.path.as_posix())
+            Git.add([file.posix_path])
 
 
 def main():
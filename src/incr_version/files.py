@@ -6,32 +6,51 @@ file.
 from __future__ import annotations
 
 import logging
+import mmap
 import os
 import re
-from contextlib import ExitStack
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from tempfile import TemporaryDirectory
+from typing import Iterator
 
 from .exceptions import VersionIncrError
 from .git import Git
-from .utils import get_precommit_cached, running_under_precommit, updated_version_line
+from .utils import get_precommit_cached, map_file, running_under_precommit, updated_version_line
 
 __all__ = ['VersionFile']
 log = logging.getLogger(__name__)
 
 _NotSet = object()
-VERSION_PAT = re.compile(r'^(\s*__version__\s?=\s?)(["\'])(\d{4}\.\d{2}\.\d{2}(?:-\d+)?)\2$')
+# Both version patterns are built from this, so they always agree on what a version line is.  Whitespace is limited to
+# spaces/tabs (rather than \s) so that the multiline file pattern cannot match across lines.
+_VERSION_LINE_PAT = r'([ \t]*__version__[ \t]?=[ \t]?)(["\'])(\d{4}\.\d{2}\.\d{2}(?:-\d+)?)\2'
+# Used to match individual lines (without line endings)
+VERSION_PAT = re.compile('^' + _VERSION_LINE_PAT + '$')
+# Used to find the version line when scanning whole files; the line ending is not included in the match, and a UTF-8
+# BOM at the beginning of the file is allowed before the first line
+_VERSION_PAT_BYTES = re.compile(rb'(?:^|(?<=\A\xef\xbb\xbf))' + _VERSION_LINE_PAT.encode() + rb'(?=\r?$)', re.MULTILINE)
+# The characters that may appear in a version line; encodings that encode these as ASCII does can be searched as bytes
+_ASCII_PROBE = '__version__ =\t"\'0123456789.-\r\n'
+# Names (lower case) of directories that will not be searched for a version file
+# TODO: Make exclusions configurable, or interpret .gitignore?
+SKIP_DIRS = frozenset(
+    ('.git', '.venv', 'venv', 'site-packages', 'build', 'dist', '__pycache__', 'node_modules', '.tox', '.mypy_cache')
+)
 
 
 class VersionFile:
     def __init__(self, path: Path, encoding: str = 'utf-8', dry_run: bool = False):
         self.path: Path = path
+        self.posix_path: str = path.as_posix()
         self.encoding = encoding
         self._version = _NotSet
         self.dry_run = dry_run
 
     def __repr__(self) -> str:
-        return f'<{self.__class__.__name__}[path={self.path.as_posix()}, version={self.version!r}]>'
+        # The version is only included if it was already read, to avoid reading the file just to log this object
+        version = '?' if self._version is _NotSet else repr(self._version)
+        return f'<{self.__class__.__name__}[path={self.posix_path}, {version=!s}]>'
 
     def should_update(self, ignore_staged=False, update_amended=False, ignore_cache_age=False) -> bool:
         if self.is_modified_and_unstaged(ignore_cache_age):
@@ -44,75 +63,108 @@ class VersionFile:
                 log.info(f'File={self} is already staged in git - assuming it has correct version already')
                 return False
 
-            log.debug(f'File={self} is already staged in git - checking the staged version number')
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(f'File={self} is already staged in git - checking the staged version number')
             if self.staged_version_was_modified():
                 log.info(f'A version update was already staged for {self} - exiting')
                 return False
 
-            log.debug(f'File={self} was already staged with changes, but it does not contain a version update')
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(f'File={self} was already staged with changes, but it does not contain a version update')
         elif Git.current_commit_is_amending():
             if not update_amended:
                 log.info('The current commit is using --amend - exiting')
                 return False
             log.info('The current commit is using --amend - updating')
-        else:
+        elif log.isEnabledFor(logging.DEBUG):
             log.debug(f'File={self} is not already staged in git')
 
         return True
 
     def is_modified_and_unstaged(self, ignore_cache_age: bool = False) -> bool:
         if running_under_precommit():
-            return self.path.as_posix() in get_precommit_cached(ignore_cache_age)
-        return self.path.as_posix() in Git.get_unstaged_modified()
+            return Git.repo_relative(self.posix_path) in get_precommit_cached(ignore_cache_age)
+        return Git.is_path_modified(self.posix_path)
 
     def is_staged(self) -> bool:
-        return self.path.as_posix() in Git.get_staged()
+        return Git.is_path_staged(self.posix_path)
 
     def staged_version_was_modified(self) -> bool:
-        return any(VERSION_PAT.match(line) for line in Git.staged_changed_lines(self.path.as_posix()))
+        lines = Git.staged_changed_lines(self.posix_path)
+        return any('__version__' in line and VERSION_PAT.match(line) for line in lines)
 
     @property
     def version(self) -> str | None:
         if self._version is _NotSet:
-            with self.path.open('r', encoding=self.encoding) as f:
-                for line in f:
-                    if m := VERSION_PAT.match(line):
-                        self._version = m.group(3)
-                        break
+            with self._open_data() as (data, encoding):
+                if m := _search_version(data):
+                    self._version = m.group(3).decode(encoding)
                 else:
                     self._version = None
         return self._version
 
+    @contextmanager
+    def _open_data(self) -> Iterator[tuple[mmap.mmap | bytes, str]]:
+        """
+        Yields the content of this file as bytes, along with the encoding of those bytes.  Files with an ASCII-compatible
+        encoding are memory-mapped as-is.  The content of other files (such as UTF-16) is re-encoded as UTF-8, so that
+        the same bytes pattern can be used to find the version in all files.
+        """
+        if _is_ascii_compatible(self.encoding):
+            with self.path.open('rb') as f, map_file(f) as data:
+                yield data, self.encoding
+        else:
+            yield self.path.read_bytes().decode(self.encoding).encode('utf-8'), 'utf-8'
+
     def contains_version(self) -> bool:
         return bool(self.version)
 
-    def update_version(self, no_pipe_bypass: bool = False, force_suffix: bool = False):
-        found = False
-        with TemporaryDirectory() as tmp_dir:
-            tmp_path = Path(tmp_dir).joinpath('tmp.txt')
-            log.debug(f'Writing updated file to temp file={tmp_path}')
-            with ExitStack() as stack:
-                f_in = stack.enter_context(self.path.open('r', encoding=self.encoding))
-                f_out = stack.enter_context(tmp_path.open('w', encoding=self.encoding, newline='\n'))
-                for line in f_in:
-                    if found:
-                        f_out.write(line)
-                    elif m := VERSION_PAT.match(line):
-                        found = True
-                        new_line = updated_version_line(m.groups(), no_pipe_bypass, force_suffix, self.dry_run)
-                        f_out.write(new_line)
-                    else:
-                        f_out.write(line)
-
-            if found:
-                if self.dry_run:
-                    log.debug(f'[DRY RUN] Would replace original file={self.path} with modified version')
-                else:
-                    log.debug(f'Replacing original file={self.path} with modified version')
-                    tmp_path.replace(self.path)
-            else:
+    def update_version(self, no_pipe_bypass: bool = False, force_suffix: bool = False) -> bool:
+        """
+        :param no_pipe_bypass: Do not bypass pre-commit's stdout pipe when printing the updated version number
+        :param force_suffix: Force use of a numeric suffix, even on the first version for a given day
+        :return: True if the file was modified, False otherwise
+        """
+        with self._open_data() as (data, enc):
+            if not (m := _search_version(data)):
                 raise VersionIncrError(f'No valid version was found in {self.path}')
 
+            assignment, quote, old_ver = m[1].decode(enc), m[2].decode(enc), m[3].decode(enc)
+            new_line = updated_version_line(assignment, quote, old_ver, no_pipe_bypass, force_suffix, self.dry_run)
+            new_line = new_line.encode(enc)
+            unchanged = new_line == m.group(0)
+            updated = b''.join((data[: m.start()], new_line, data[m.end() :]))
+
+        if unchanged:
+            log.debug(f'The version in file={self.path} is already up to date - no update needed')
+            return False
+        elif self.dry_run:
+            log.debug(f'[DRY RUN] Would replace original file={self.path} with modified version')
+            return False
+        elif enc != self.encoding:  # The content was re-encoded for the search, so it is converted back
+            updated = updated.decode(enc).encode(self.encoding)
+
+        from shutil import copymode
+        from tempfile import mkstemp
+
+        # The temp file is created in the same directory so that the final replacement is an atomic rename
+        tmp_fd, tmp_path = mkstemp(dir=self.path.parent, prefix='.__version__.', suffix='.tmp')
+        log.debug(f'Writing updated file to temp file={tmp_path}')
+        try:
+            with os.fdopen(tmp_fd, 'wb') as f_out:
+                f_out.write(updated)
+            copymode(self.path, tmp_path)  # Temp files are created with 0600 permissions
+            log.debug(f'Replacing original file={self.path} with modified version')
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        return True
+
     @classmethod
     def find(cls, path: Path | str | None, *args, **kwargs) -> VersionFile:
         if path:
@@ -121,14 +173,59 @@ class VersionFile:
                 return cls(path, *args, **kwargs)
             raise VersionIncrError('--file / -f must be the path to a file that exists')
 
-        # TODO: Make exclusions configurable, or interpret .gitignore?
-        ignore = re.compile(r'[/\\](\.?venv|site-packages|build)(?:[/\\]|$)', re.IGNORECASE).search
-        for root, dirs, files in os.walk(os.getcwd()):
-            if not ignore(root) and '__version__.py' in files:
-                return cls(Path(root).joinpath('__version__.py'), *args, **kwargs)
+        if version_path := _find_version_file(os.getcwd()):
+            return cls(Path(version_path), *args, **kwargs)
 
         # TODO: Support setup.cfg?
         setup_path = Path('setup.py')
         if setup_path.is_file():
             return cls(setup_path, *args, **kwargs)
         raise VersionIncrError('Unable to find __version__.py or setup.py - please specify a --file / -f to modify')
+
+
+@lru_cache(maxsize=4)
+def _is_ascii_compatible(encoding: str) -> bool:
+    try:
+        return _ASCII_PROBE.encode(encoding) == _ASCII_PROBE.encode('ascii')
+    except UnicodeEncodeError:
+        return False
+
+
+def _search_version(data: mmap.mmap | bytes) -> re.Match | None:
+    # A plain substring search is much faster than the regex, so it is used to skip to the first candidate line
+    if (index := data.find(b'__version__')) == -1:
+        return None
+    return _VERSION_PAT_BYTES.search(data, data.rfind(b'\n', 0, index) + 1)
+
+
+def _find_version_file(root: str) -> str | None:
+    """
+    Depth-first search for a ``__version__.py`` file, checking the files in each directory before descending into its
+    subdirectories.  Ignored directories are pruned before recursing into them, and the search stops at the first match.
+    """
+    try:
+        entries = os.scandir(root)
+    except OSError as e:  # Unreadable directories are skipped, as os.walk would do
+        log.debug(f'Unable to scan {root}: {e}')
+        return None
+
+    dirs = []
+    with entries:
+        try:
+            for entry in entries:
+                # DirEntry type checks use the type info from the directory listing when possible (no extra stat)
+                try:
+                    if entry.name == '__version__.py':
+                        if entry.is_file():
+                            return entry.path
+                    elif entry.is_dir(follow_symlinks=False) and entry.name.lower() not in SKIP_DIRS:
+                        dirs.append(entry.path)
+                except OSError:  # The entry may have been removed; it is skipped, as os.walk would do
+                    pass
+        except OSError as e:  # The listing could not be completed; the subdirectories found so far are still searched
+            log.debug(f'Unable to finish scanning {root}: {e}')
+
+    for path in dirs:
+        if version_path := _find_version_file(path):
+            return version_path
+    return None
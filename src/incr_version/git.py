@@ -1,23 +1,75 @@
+from __future__ import annotations
+
 import logging
-from subprocess import PIPE, Popen
-from typing import Iterator
+import os
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from subprocess import DEVNULL, PIPE
+from typing import Any, Callable, Iterable, Iterator, TypeVar
 
 from .exceptions import VersionIncrError
-from .utils import get_git_commit_parent_cmdline
+from .utils import get_git_commit_parent_cmdline, running_under_precommit
 
 __all__ = ['Git']
 log = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
 
 class Git:
+    _results: dict[str, Any] = {}
+    _pending: dict[str, Future] = {}
+
+    @classmethod
+    def prefetch(cls, path: str):
+        """
+        Start the independent read-only git queries that are needed to determine whether the given version file should
+        be updated in background threads, so that they run concurrently with each other and with the (in-process)
+        search of the parent processes for the ``git commit`` command.  Their results are consumed by the methods that
+        would otherwise run them.  Any results from a previous call are discarded.
+
+        When running under pre-commit, its patch file is used to identify unstaged changes instead of the stash, so the
+        stash check is skipped to avoid spawning a git process that would not be used.
+
+        :param path: The path of the version file
+        """
+        cls._results = {}
+        executor = ThreadPoolExecutor(max_workers=2)
+        # Submitted before checking for pre-commit, since that check may need to walk the process tree
+        cls._pending = {f'status:{path}': executor.submit(cls._get_status, path)}
+        if running_under_precommit():  # The repo root is needed to compare the path to those in pre-commit's patch
+            cls._pending['toplevel'] = executor.submit(cls._get_toplevel)
+        else:
+            cls._pending['stashed'] = executor.submit(cls._has_stashed)
+        executor.shutdown(wait=False)
+
+    @classmethod
+    def _get_result(cls, key: str, func: Callable[[], T]) -> T:
+        try:
+            return cls._results[key]
+        except KeyError:
+            pass
+        if future := cls._pending.pop(key, None):
+            result = future.result()
+        else:
+            result = func()
+        cls._results[key] = result
+        return result
+
     @classmethod
     def run(cls, *args: str) -> str:
+        return cls.run_bytes(*args).decode('utf-8')
+
+    @classmethod
+    def run_bytes(cls, *args: str) -> bytes:
         cmd = ['git', *args]
         cmd_str = ' '.join(cmd)
         log.debug(f'Executing `{cmd_str}`')
-        proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
-        stdout, stderr = proc.communicate()
-        if (code := proc.wait()) != 0:
+        proc = subprocess.run(cmd, capture_output=True, check=False)
+        stdout, stderr = proc.stdout, proc.stderr
+        if (code := proc.returncode) != 0:
             err_msg_parts = [f'Error executing `{cmd_str}` - exit {code=}']
             if stdout:
                 err_msg_parts.append(f'stdout:\n{stdout}')
@@ -27,47 +79,145 @@ class Git:
             raise VersionIncrError('\n'.join(err_msg_parts))
         if stderr:
             log.warning(f'Found stderr for cmd=`{cmd_str}`:\n{stderr}')
-        return stdout.decode('utf-8')
+        return stdout
+
+    @classmethod
+    def run_silent(cls, *args: str) -> int:
+        """Run a git command for which only the exit code is relevant, and return that code."""
+        cmd = ['git', *args]
+        log.debug(f'Executing `{" ".join(cmd)}`')
+        return subprocess.run(cmd, stdout=DEVNULL, stderr=DEVNULL).returncode
+
+    @classmethod
+    def add(cls, paths: Iterable[str]) -> str:
+        """Add all of the given paths using a single ``git add`` call (the index lock is only acquired once)."""
+        return cls.run('add', '--', *paths)
+
+    @classmethod
+    def _get_status(cls, *paths: str) -> tuple[set[str], set[str]]:
+        """
+        Determines both the staged and the unstaged+modified files using a single ``git status`` call, rather than
+        running separate ``git diff`` commands for each.
+
+        :param paths: If specified, only the status of these paths will be checked
+        :return: Tuple of (staged files, modified files that are not staged)
+        """
+        staged, modified = set(), set()
+        cmd = ['status', '--porcelain=v1', '-z', '--untracked-files=no']
+        if paths:
+            cmd += ['--', *paths]
+        entries = iter(cls.run_bytes(*cmd).split(b'\0'))
+        for entry in entries:
+            if not entry:
+                continue
+            index_status, tree_status, path = entry[0:1], entry[1:2], entry[3:].decode('utf-8')
+            if index_status in b'RC':
+                next(entries, None)  # The original path of a rename/copy is provided as a separate entry
+            if index_status not in b' ?!':
+                staged.add(path)
+            if tree_status == b'M':
+                modified.add(path)
+
+        if log.isEnabledFor(logging.DEBUG):
+            matching = f' matching {", ".join(paths)}' if paths else ''
+            log.debug(f'Files{matching} staged in the current commit:\n' + '\n'.join(sorted(staged)))
+        return staged, modified
 
     @classmethod
-    def add(cls, *args: str) -> str:
-        return cls.run('add', *args)
+    def _get_toplevel(cls) -> str:
+        return cls.run('rev-parse', '--show-toplevel').rstrip('\n')
+
+    @classmethod
+    def repo_relative(cls, path: str) -> str:
+        """The given path relative to the root of the repo, in the posix form that git uses in its output"""
+        top = cls._get_result('toplevel', cls._get_toplevel)
+        return Path(os.path.relpath(os.path.realpath(path), os.path.realpath(top))).as_posix()
 
     @classmethod
     def get_staged(cls) -> set[str]:
-        files = cls.run('diff', '--name-only', '--cached').splitlines()
-        log.debug('Files staged in the current commit:\n' + '\n'.join(files))
-        return set(files)
+        return cls._get_result('status', cls._get_status)[0]
+
+    @classmethod
+    def _get_path_status(cls, path: str) -> tuple[set[str], set[str]]:
+        return cls._get_result(f'status:{path}', partial(cls._get_status, path))
+
+    @classmethod
+    def is_path_staged(cls, path: str) -> bool:
+        # Only the given path is queried, so any staged entry is for that path (regardless of the relative/absolute
+        # form of the path that was provided)
+        return bool(cls._get_path_status(path)[0])
+
+    @classmethod
+    def is_path_modified(cls, path: str) -> bool:
+        """Whether the given path contains modifications that were not staged"""
+        if cls.has_stashed():
+            return cls.repo_relative(path) in cls.get_unstaged_modified()
+        return bool(cls._get_path_status(path)[1])
+
+    @classmethod
+    def _has_stashed(cls) -> bool:
+        return cls.run_silent('rev-parse', '--verify', '--quiet', 'refs/stash') == 0
 
     @classmethod
     def has_stashed(cls) -> bool:
-        return bool(cls.run('stash', 'list').strip())
+        return cls._get_result('stashed', cls._has_stashed)
+
+    @classmethod
+    def run_stream(cls, *args: str) -> Iterator[bytes]:
+        """
+        Run a git command and yield its stdout lines (as bytes, including line endings) as git produces them, so that
+        large output does not need to be buffered, and so that a consumer can stop early.  If the consumer stops before
+        the end of the output, then the git process is terminated.  A non-zero exit code is only reported if the output
+        was fully consumed.
+        """
+        from tempfile import TemporaryFile
+
+        cmd = ['git', *args]
+        cmd_str = ' '.join(cmd)
+        log.debug(f'Executing `{cmd_str}`')
+        # stderr is not read until stdout is exhausted, so it is written to a file instead of a pipe that could fill up
+        # and block git while this is waiting for more stdout
+        with TemporaryFile() as stderr_file:
+            proc = subprocess.Popen(cmd, stdout=PIPE, stderr=stderr_file, bufsize=-1)
+            try:
+                yield from proc.stdout
+                if (code := proc.wait()) != 0:
+                    stderr_file.seek(0)
+                    stderr = stderr_file.read()
+                    raise VersionIncrError(f'Error executing `{cmd_str}` - exit {code=}\nstderr:\n{stderr}')
+            finally:
+                proc.stdout.close()
+                if proc.poll() is None:  # The consumer stopped before reaching the end of the output
+                    proc.terminate()
+                    proc.wait()
 
     @classmethod
     def staged_changed_lines(cls, path: str) -> Iterator[str]:
-        stdout = cls.run('diff', '--staged', '--no-color', '-U0', path)
-        for line in stdout.splitlines():
-            if line.startswith('+') and not line.startswith('+++ b/'):
-                yield line[1:]
+        for line in cls.run_stream('diff', '--staged', '--no-color', '-U0', path):
+            if line.startswith(b'+') and not line.startswith(b'+++ b/'):
+                yield line[1:].rstrip(b'\r\n').decode('utf-8')
 
     @classmethod
     def get_unstaged_modified(cls) -> set[str]:
-        if cls.has_stashed():
-            staged = cls.get_staged()
-            cmd = ('stash', 'show', '--name-status')
+        debug = log.isEnabledFor(logging.DEBUG)
+        if not cls.has_stashed():
+            files = cls._get_result('status', cls._get_status)[1]
         else:
-            staged = set()
-            cmd = ('diff', '--name-status')
-
-        files = set()
-        for line in cls.run(*cmd).splitlines():
-            log.debug(f'diff {line=}')
-            status, file = map(str.strip, line.split(maxsplit=1))
-            if status == 'M' and file not in staged:
-                files.add(file)
-            else:
-                log.debug(f'Ignoring {file=} with {status=}')
-        log.debug('Modified files NOT staged in the current commit:\n' + '\n'.join(files))
+            staged = cls.get_staged()
+            lines = cls.run_stream('stash', 'show', '--name-status')
+            if debug:
+                lines = list(lines)
+                log.debug('Files changed in the latest stash:\n' + b''.join(lines).decode('utf-8'))
+            files = {
+                file
+                for line in lines
+                if (parts := line.decode('utf-8').split(maxsplit=1))
+                and parts[0] == 'M'
+                and (file := parts[1].strip()) not in staged
+            }
+
+        if debug:
+            log.debug('Modified files NOT staged in the current commit:\n' + '\n'.join(files))
         return files
 
     @classmethod
@@ -76,6 +226,6 @@ class Git:
 
     @classmethod
     def current_commit_is_amending(cls) -> bool:
-        if cmdline := get_git_commit_parent_cmdline():
+        if cmdline := cls.get_current_commit_command():
             return '--amend' in cmdline
         return False
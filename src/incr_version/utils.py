@@ -1,33 +1,52 @@
+from __future__ import annotations
+
 import logging
+import mmap
 import os
 import re
-from datetime import date, datetime
+import sys
+from contextlib import nullcontext
+from datetime import date
+from functools import lru_cache
 from pathlib import Path
 from time import time
-
-from psutil import NoSuchProcess, Process
+from typing import TYPE_CHECKING, BinaryIO, ContextManager, Iterator
 
 from .exceptions import VersionIncrError
 
+if TYPE_CHECKING:
+    from psutil import Process
+
 __all__ = [
     'stdout_write',
     'updated_version_line',
     'running_under_precommit',
     'get_precommit_cached',
+    'iter_parent_cmdlines',
     'get_proc',
     'get_git_commit_parent_cmdline',
     'next_version',
+    'map_file',
     'parse_bool',
 ]
 log = logging.getLogger(__name__)
 ON_WINDOWS = os.name == 'nt'
+_TTY_PATH = 'con:' if ON_WINDOWS else '/dev/tty'
+
+_DIFF_GIT_FINDITER = re.compile(rb'^diff --git a/(.*?) b/\1$', re.MULTILINE).finditer
+_GIT_PROG_SUFFIXES = ('\\git.exe', '/git')
+_PRE_COMMIT_CMD = ('env', '.git/hooks/pre-commit')
+_BOOL_MAP = {
+    **dict.fromkeys(('t', 'y', 'yes', 'true', '1'), True),
+    **dict.fromkeys(('f', 'n', 'no', 'false', '0'), False),
+}
 
 
 def stdout_write(msg: str, no_pipe_bypass: bool = False):
     if not no_pipe_bypass:
         try:
             # Note: this is not intended to be called more than once per run.
-            with open('con:' if ON_WINDOWS else '/dev/tty', 'w', encoding='utf-8') as stdout:
+            with open(_TTY_PATH, 'w', encoding='utf-8') as stdout:
                 stdout.write(msg)
         except OSError:  # This may occur if committing via PyCharm, for example
             pass  # The message couldn't be written, so we will fall back to writing to stdout
@@ -37,6 +56,12 @@ def stdout_write(msg: str, no_pipe_bypass: bool = False):
     print(msg, end='', flush=True)
 
 
+@lru_cache(maxsize=1)
+def _today() -> tuple[date, str]:
+    today = date.today()
+    return today, today.strftime('%Y.%m.%d')
+
+
 def next_version(old_ver: str, force_suffix: bool = False) -> str:
     try:
         old_date_str, old_suffix = old_ver.split('-')
@@ -44,9 +69,9 @@ def next_version(old_ver: str, force_suffix: bool = False) -> str:
         old_date_str = old_ver
         old_suffix = ''
 
-    old_date = datetime.strptime(old_date_str, '%Y.%m.%d').date()
-    today = date.today()
-    today_str = today.strftime('%Y.%m.%d')
+    # The version format is fixed (YYYY.MM.DD), so the date is parsed by slicing instead of the much slower strptime
+    old_date = date(int(old_date_str[:4]), int(old_date_str[5:7]), int(old_date_str[8:10]))
+    today, today_str = _today()
     if old_date < today and not force_suffix:
         return today_str
     else:
@@ -54,8 +79,15 @@ def next_version(old_ver: str, force_suffix: bool = False) -> str:
         return f'{today_str}-{new_suffix}'
 
 
-def updated_version_line(groups, no_pipe_bypass, force_suffix=False, dry_run=False) -> str:
-    old_ver = groups[2]
+def updated_version_line(
+    assignment: str, quote: str, old_ver: str, no_pipe_bypass, force_suffix=False, dry_run=False
+) -> str:
+    """
+    :param assignment: The ``__version__ =`` portion of the version line, including any surrounding whitespace
+    :param quote: The quote character used around the version
+    :param old_ver: The current version
+    :return: The updated version line, without a line ending
+    """
     new_ver = next_version(old_ver, force_suffix)
     if no_pipe_bypass:
         prefix = '[DRY RUN] Would replace' if dry_run else 'Replacing'
@@ -65,26 +97,36 @@ def updated_version_line(groups, no_pipe_bypass, force_suffix=False, dry_run=Fal
         # output instead of letting output pass thru directly
         prefix = '[DRY RUN] ' if dry_run else ''
         stdout_write(f' {prefix}({old_ver} -> {new_ver}) ')
-    return '{0}{1}{2}{1}\n'.format(groups[0], groups[1], new_ver)
+    return f'{assignment}{quote}{new_ver}{quote}'
 
 
+@lru_cache(maxsize=1)
 def get_git_commit_parent_cmdline() -> list[str] | None:
-    for proc in get_proc().parents():
-        cmdline = list(map(str.lower, proc.cmdline()))  # noqa
+    for cmdline in _parent_cmdlines():
+        cmdline = list(map(str.lower, cmdline))
         try:
             prog, arg = cmdline[0:2]
         except (IndexError, ValueError):
             pass
         else:
-            if arg == 'commit' and prog.endswith(('\\git.exe', '/git')):
+            if arg == 'commit' and prog.endswith(_GIT_PROG_SUFFIXES):
                 return cmdline
     return None
 
 
+@lru_cache(maxsize=1)
 def running_under_precommit() -> bool:
-    this_proc = get_proc()
-    pre_commit_cmd = ['env', '.git/hooks/pre-commit']
-    return any(proc.cmdline() == pre_commit_cmd for proc in this_proc.parents())
+    if 'PRE_COMMIT' in os.environ:  # pre-commit sets this for the hooks that it runs
+        return True
+    return _PRE_COMMIT_CMD in _parent_cmdlines()
+
+
+@lru_cache(maxsize=1)
+def _precommit_cache_dir() -> Path:
+    """The directory that pre-commit uses for its cache, resolved the same way that pre-commit resolves it"""
+    if not (path := os.environ.get('PRE_COMMIT_HOME')):
+        path = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'pre-commit')
+    return Path(path).resolve()
 
 
 def get_precommit_cached(ignore_cache_age: bool = False) -> set[str]:
@@ -95,20 +137,66 @@ def get_precommit_cached(ignore_cache_age: bool = False) -> set[str]:
       not provide any external means of correlating the pid/commit with the file.
     :return: The files that were modified, but not staged for the commit, and were cached in a patch file by pre-commit
     """
-    cache_dir = Path('~/.cache/pre-commit/').expanduser().resolve()
-    patches = [p.name for p in cache_dir.iterdir() if p.name.startswith('patch')]
-    latest = cache_dir.joinpath(max(patches))
-    age = time() - latest.stat().st_mtime
+    cache_dir = _precommit_cache_dir()
+    try:
+        with os.scandir(cache_dir) as entries:
+            patches = (entry for entry in entries if entry.name.startswith('patch'))
+            latest = max(patches, key=lambda entry: entry.stat().st_mtime, default=None)
+    except OSError as e:
+        log.debug(f'Unable to scan the pre-commit cache dir={cache_dir}: {e}')
+        return set()
+    if latest is None:
+        log.debug(f'No pre-commit patch files were found in {cache_dir}')
+        return set()
+
+    age = time() - latest.stat().st_mtime  # DirEntry caches the stat result
     if age > 5 and not ignore_cache_age:
         log.debug(f'The pre-commit cache file is {age:,.3f}s old - ignoring it')
         return set()
 
-    diff_match = re.compile(r'diff --git a/(.*?) b/\1$').match
-    with latest.open('r', encoding='utf-8') as f:
-        return {m.group(1) for line in f if (m := diff_match(line))}
+    # The whole file is scanned in a single pass by the regex engine instead of iterating over it line by line
+    with open(latest.path, 'rb') as f, map_file(f) as data:
+        return {m.group(1).decode('utf-8') for m in _DIFF_GIT_FINDITER(data)}
 
 
+@lru_cache(maxsize=1)
+def _parent_cmdlines() -> tuple[tuple[str, ...], ...]:
+    """The command lines of all ancestors of this process, so that the process tree only needs to be walked once"""
+    return tuple(map(tuple, iter_parent_cmdlines()))
+
+
+def iter_parent_cmdlines() -> Iterator[list[str]]:
+    """
+    Yields the command line of each ancestor of this process, starting with its direct parent.  On Linux, this reads
+    ``/proc`` directly to avoid the cost of importing psutil; psutil is used on other platforms (where procfs, if it is
+    mounted at all, does not use the same layout).
+    """
+    if not sys.platform.startswith('linux'):
+        for proc in get_proc().parents():
+            yield proc.cmdline()
+        return
+
+    pid = os.getpid()
+    while True:
+        try:
+            with open(f'/proc/{pid}/status', 'rb') as f:
+                pid = next((int(line[5:]) for line in f if line.startswith(b'PPid:')), 0)
+            if not pid:
+                return
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                data = f.read()
+        except (OSError, ValueError):  # The process may have exited
+            return
+
+        if data.endswith(b'\0'):
+            data = data[:-1]
+        yield [os.fsdecode(arg) for arg in data.split(b'\0')] if data else []
+
+
+@lru_cache(maxsize=1)
 def get_proc() -> Process:
+    from psutil import NoSuchProcess, Process
+
     pid = os.getpid()
     try:
         return Process(pid)
@@ -116,15 +204,18 @@ def get_proc() -> Process:
         raise VersionIncrError(f'Unable to find process with {pid=} (this process)') from e
 
 
+def map_file(f: BinaryIO) -> ContextManager[mmap.mmap | bytes]:
+    """Memory-map the given file for reading.  Empty files cannot be mapped, so an empty bytes object is used for them."""
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        return nullcontext(b'')
+
+
 def parse_bool(value: str | bool) -> bool:
-    original = value
     if isinstance(value, bool):
         return value
-    elif isinstance(value, str):
-        value = value.strip().lower()
-        if value in ('t', 'y', 'yes', 'true', '1'):
-            return True
-        elif value in ('f', 'n', 'no', 'false', '0'):
-            return False
+    elif isinstance(value, str) and (result := _BOOL_MAP.get(value.strip().lower())) is not None:
+        return result
     # ValueError works with argparse to provide a useful error message
-    raise ValueError(f'Unable to parse boolean value from input: {original!r}')
+    raise ValueError(f'Unable to parse boolean value from input: {value!r}')